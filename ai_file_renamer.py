@@ -1,44 +1,206 @@
 """AI File Renamer - An agent that uses LLM to plan and execute file renames."""
+import argparse
 import os
-import json
 import logging
+import logging.handlers
+import re
+import secrets
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from functools import partial
 from pathlib import Path
-from typing import List, Dict, Optional, Any
+from typing import List, Dict, Optional, Any, Set, Tuple, Union
 
-# Import LLM interface for file renaming
-from llm_interface import get_rename_plan_from_llm
+from dotenv import load_dotenv
+
+from json_cache import load_json_cache, save_json_cache
+from rename_templates import apply_template, derive_template, normalize_instruction, parse_trivial_instruction
 
 # ------------- Logging setup -------------
 
 LOG_DIR = Path("logs")
 LOG_DIR.mkdir(exist_ok=True)
 
+# Shared formatter for log handlers
+LOG_FORMATTER = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
+# Log records buffered in memory before being written out (errors are written immediately)
+LOG_BUFFER_CAPACITY = 1000
+# A session's log rolls over to .1, .2, ... once it reaches LOG_MAX_BYTES, keeping LOG_BACKUP_COUNT old parts
+LOG_MAX_BYTES = 10_000_000
+LOG_BACKUP_COUNT = 3
+
+# Logger created by the first setup_logger() call, reused afterwards
+_logger: Optional[logging.Logger] = None
+_logger_lock = threading.Lock()
+
 
 def setup_logger() -> logging.Logger:
-    """Set up logging for the file renamer."""
-    timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-    log_path = LOG_DIR / f"{timestamp}.log"
+    """Set up logging for the file renamer (once per process)."""
+    global _logger
+    with _logger_lock:
+        if _logger is not None:
+            return _logger
+
+        timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        log_path = LOG_DIR / f"{timestamp}.log"
+
+        logger = logging.getLogger("ai_file_renamer")
+        logger.setLevel(logging.INFO)
+
+        # Avoid adding multiple handlers if the logger was configured elsewhere
+        if not logger.handlers:
+            # delay=True: the file is only created once the first record is written
+            fh = logging.handlers.RotatingFileHandler(
+                log_path, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, delay=True
+            )
+            fh.setLevel(logging.INFO)
+            fh.setFormatter(LOG_FORMATTER)
+            # Buffer records so a large rename batch is written in a few writes, not one per file.
+            # logging.shutdown() flushes the buffer at exit, so nothing is lost on quit or sys.exit()
+            mh = logging.handlers.MemoryHandler(LOG_BUFFER_CAPACITY, flushLevel=logging.ERROR, target=fh)
+            logger.addHandler(mh)
+
+        logger.info("=== New run started ===")
+        logger.info("Logging to %s", log_path)
+        _logger = logger
+        return logger
+
+
+# ------------- Plan caches -------------
+
+# Rename templates learned from accepted LLM plans, keyed by normalized instruction
+TEMPLATE_CACHE_PATH = LOG_DIR / ".template_cache.json"
+
+
+def discard_cached_plan(
+    directory: Path,
+    instruction: str,
+    files: List[Dict[str, Any]],
+    total_files: Optional[int] = None
+) -> None:
+    """
+    Forget cached results for a request (e.g. the plan was rejected), so the
+    next identical request asks the LLM again.
+    """
+    # A cached LLM response can only have been served if the module is loaded
+    llm_interface = sys.modules.get("llm_interface")
+    if llm_interface is not None:
+        llm_interface.discard_cached_response(str(directory), instruction, files, total_files)
+    if load_json_cache(TEMPLATE_CACHE_PATH).pop(normalize_instruction(instruction), None) is not None:
+        save_json_cache(TEMPLATE_CACHE_PATH)
 
-    logger = logging.getLogger("ai_file_renamer")
-    logger.setLevel(logging.INFO)
 
-    # Avoid adding multiple handlers if function is called again
-    if not logger.handlers:
-        fh = logging.FileHandler(log_path)
-        fh.setLevel(logging.INFO)
-        fmt = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
-        fh.setFormatter(fmt)
-        logger.addHandler(fh)
+def plan_from_template(
+    instruction: str,
+    files: List[Dict[str, Any]],
+    total_files: Optional[int] = None,
+    use_learned: bool = True
+) -> Optional[Dict]:
+    """
+    Build a rename plan locally, without the LLM, when the instruction spells
+    out a simple numbering or a template was learned for it.
+    
+    Args:
+        instruction: User's natural language instruction
+        files: File info dictionaries
+        total_files: Number of matching files in the directory, if files is only a sample
+        use_learned: Also use templates learned from earlier plans (--no-cache disables)
+    
+    Returns:
+        Plan dictionary, or None if no template fits these files
+    """
+    template = parse_trivial_instruction(instruction)
+    if template is None and use_learned:
+        template = load_json_cache(TEMPLATE_CACHE_PATH).get(normalize_instruction(instruction))
+    # Templates number every file, so they need the complete listing, not a sample
+    if template is None or (total_files is not None and total_files != len(files)):
+        return None
+    renames = apply_template(template, files)
+    return {"renames": renames} if renames is not None else None
 
-    logger.info("=== New run started ===")
-    logger.info(f"Logging to {log_path}")
-    return logger
+
+def learn_template(
+    instruction: str,
+    files: List[Dict[str, Any]],
+    total_files: Optional[int],
+    renames: List[Dict],
+    metadata_fields: Set[str]
+) -> None:
+    """Remember an accepted plan's numbering pattern so the instruction can be reused without the LLM."""
+    if total_files is not None and total_files != len(files):
+        return
+    template = derive_template(files, renames, metadata_fields)
+    if template is not None:
+        load_json_cache(TEMPLATE_CACHE_PATH)[normalize_instruction(instruction)] = template
+        save_json_cache(TEMPLATE_CACHE_PATH)
+        logging.getLogger("ai_file_renamer").info("Learned rename template: %s", template)
 
 
 # ------------- Core functions -------------
 
+# Directories with more files than this are stat-ed on a thread pool
+PARALLEL_STAT_THRESHOLD = 100
+# Files shown to the LLM for large directories (matches llm_interface.MAX_FILES_FOR_LLM)
+LLM_SAMPLE_SIZE = 500
+# Instruction words (3+ letters/digits) used to pick relevant files for the LLM sample
+INSTRUCTION_TOKEN_RE = re.compile(r'[a-z0-9]{3,}')
+# Rename batches larger than this are dispatched on a thread pool
+PARALLEL_RENAME_THRESHOLD = 16
+# Result rename_batch reports for renames it skipped after an earlier failure
+RENAME_SKIPPED = RuntimeError("not attempted after an earlier failure")
+# Prefix for temporary names during swaps: random once per process, then a counter per file
+TEMP_PREFIX = f".temp_{secrets.token_hex(4)}_"
+
+# Illegal characters for filenames (Windows + Unix)
+ILLEGAL_CHARS = '/\\:*?"<>|\x00'
+# Translation table deleting illegal characters, for a single C-level pass
+ILLEGAL_CHARS_TABLE = str.maketrans('', '', ILLEGAL_CHARS)
+
+# Common file type mentions -> extensions to filter on, in priority order
+# (add more as needed)
+EXTENSION_KEYWORDS = {
+    'jpg': ['.jpg', '.jpeg'],
+    'jpeg': ['.jpg', '.jpeg'],
+    'png': ['.png'],
+    'txt': ['.txt'],
+    'text': ['.txt'],
+    'pdf': ['.pdf'],
+}
+
+# Metadata groups that can be collected for the LLM (see get_file_info)
+METADATA_FIELDS = ('creation', 'modification', 'access', 'size')
+
+# Instruction keywords that call for a specific metadata group
+METADATA_KEYWORDS = {
+    'creation': ('creat',),
+    'modification': ('modif', 'edit', 'updat', 'changed'),
+    'access': ('access', 'opened', 'viewed'),
+    'size': ('size', 'largest', 'smallest', 'biggest', 'bytes'),
+}
+
+# Keywords that ask for date ordering without saying which timestamp
+DATE_KEYWORDS = ('date', 'time', 'oldest', 'newest', 'older', 'newer', 'earliest', 'latest',
+                 'recent', 'chronolog')
+
+# Keywords that ask for some ordering without saying by what
+ORDER_KEYWORDS = ('order', 'sort', 'arrange', 'rank', 'sequen', 'reverse', 'number')
+
+# All instruction keywords above in one alternation, so an instruction is
+# classified in a single pass; each match's lastgroup names its keyword group.
+# File types must be whole words (optionally plural, e.g. "jpgs"); the other
+# keywords are stems matched anywhere (e.g. "creat" in "created").
+KEYWORD_RE = re.compile(
+    "(?P<extension>(?<![a-z0-9])(?:" + "|".join(EXTENSION_KEYWORDS) + ")s?(?![a-z0-9]))|"
+    + "|".join(
+        f"(?P<{group}>" + "|".join(keywords) + ")"
+        for group, keywords in {**METADATA_KEYWORDS, 'date': DATE_KEYWORDS, 'order': ORDER_KEYWORDS}.items()
+    ),
+    re.IGNORECASE,
+)
+
+
 def ask_directory() -> Optional[Path]:
     """Prompt user for directory path and validate it. Returns None if user quits."""
     while True:
@@ -54,56 +216,256 @@ def ask_directory() -> Optional[Path]:
 def ask_instruction() -> Optional[str]:
     """Prompt user for rename instruction. Returns None if user quits."""
     print("\nEnter your rename instruction (natural language, or 'q' to quit):")
-    instruction = input("> ").strip()
-    if instruction.lower() == 'q':
-        return None
-    return instruction
+    while True:
+        instruction = input("> ").strip()
+        if instruction.lower() == 'q':
+            return None
+        if instruction:
+            return instruction
+        # Ask again rather than scanning the directory for a request with nothing to do
+        print("No instruction given. Please describe how to rename the files, or 'q' to quit.")
 
 
-def list_files_in_directory(directory: Path, extensions: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+def get_file_info(entry: os.DirEntry, metadata_fields: Optional[Set[str]] = None) -> Dict[str, Any]:
+    """
+    Stat a directory entry and return its metadata dictionary.
+    
+    Times are whole-second Unix timestamps: compact in the prompt, and the
+    same values the LLM and local templates sort by.
+    
+    Args:
+        entry: Directory entry for the file
+        metadata_fields: METADATA_FIELDS groups to include (all groups if None)
+    """
+    if metadata_fields is None:
+        metadata_fields = set(METADATA_FIELDS)
+
+    info: Dict[str, Any] = {"name": entry.name}
+    if not metadata_fields:
+        return info
+
+    stat = entry.stat(follow_symlinks=False)
+    if 'creation' in metadata_fields:
+        info["creation_time"] = int(stat.st_ctime)
+    if 'modification' in metadata_fields:
+        info["modification_time"] = int(stat.st_mtime)
+    if 'access' in metadata_fields:
+        info["access_time"] = int(stat.st_atime)
+    if 'size' in metadata_fields:
+        info["size"] = stat.st_size
+    return info
+
+
+def scan_instruction_keywords(instruction: str) -> Dict[str, Set[str]]:
+    """
+    Find the known keywords in an instruction with one pass of KEYWORD_RE.
+    
+    Returns:
+        Mapping of keyword group ('extension', 'creation', ..., 'date', 'order')
+        to the lowercased words matched for it
+    """
+    found: Dict[str, Set[str]] = {}
+    for match in KEYWORD_RE.finditer(instruction):
+        found.setdefault(match.lastgroup, set()).add(match.group().lower())
+    return found
+
+
+def detect_extension_filter(keywords: Dict[str, Set[str]]) -> Optional[List[str]]:
+    """
+    Detect a file type mentioned in the instruction.
+    
+    Args:
+        keywords: Result of scan_instruction_keywords for the instruction
+    
+    Returns:
+        List of extensions to filter on, or None if no known file type is mentioned
+    """
+    mentioned = {
+        word[:-1] if word.endswith('s') else word
+        for word in keywords.get('extension', ())
+    }
+    for keyword, extensions in EXTENSION_KEYWORDS.items():
+        if keyword in mentioned:
+            return extensions
+    return None
+
+
+def detect_metadata_fields(keywords: Dict[str, Set[str]]) -> Set[str]:
+    """
+    Decide which METADATA_FIELDS groups the LLM needs to follow the instruction.
+    
+    Only the name is needed for pure pattern renames. Date wording that does
+    not name a timestamp includes all of them, and unqualified ordering
+    includes everything, so the LLM can still choose the sort key itself.
+    
+    Args:
+        keywords: Result of scan_instruction_keywords for the instruction
+    """
+    fields = set(METADATA_FIELDS) & keywords.keys()
+    time_fields = {'creation', 'modification', 'access'}
+    if not fields & time_fields and 'date' in keywords:
+        fields.update(time_fields)
+    if not fields and 'order' in keywords:
+        fields.update(METADATA_FIELDS)
+    return fields
+
+
+def scan_file_entries(directory: Path, extensions: Optional[List[str]] = None) -> List[os.DirEntry]:
+    """
+    List the directory's files, sorted by name, without stat-ing them.
+    
+    Only regular files are listed: subdirectories and symbolic links (even
+    links to files) are skipped, so symlink targets are never stat-ed or renamed.
+    
+    Args:
+        directory: Directory to list files from
+        extensions: Optional list of extensions to filter (e.g., ['.jpg', '.png'])
+    """
+    # os.scandir yields DirEntry objects, avoiding a Path allocation per entry
+    # and letting is_file() reuse the file type reported by the directory read
+    with os.scandir(directory) as it:
+        entries = [entry for entry in it if entry.is_file(follow_symlinks=False)]
+
+    if extensions:
+        # Normalize extensions (ensure they start with .)
+        normalized_exts = {ext if ext.startswith('.') else f'.{ext}' for ext in extensions}
+        entries = [e for e in entries if os.path.splitext(e.name)[1].lower() in normalized_exts]
+
+    # Sort by name by default
+    entries.sort(key=lambda e: e.name)
+    return entries
+
+
+def select_sample_entries(entries: List[os.DirEntry], instruction: str, sample_size: int) -> List[os.DirEntry]:
+    """
+    Pick the files the LLM sees when a directory has more than sample_size of them.
+    
+    Files whose names contain words from the instruction come first (up to
+    half the sample), ranked by how many they contain; words found in more
+    than half the names (e.g. "jpg") say nothing about which files are meant
+    and are ignored. The rest of the sample is spread evenly over the other
+    files so the LLM still sees the whole naming pattern. The selection is
+    deterministic, so identical requests keep hitting the plan cache.
+    
+    Returns:
+        Selected entries, in their original (name) order
+    """
+    if len(entries) <= sample_size:
+        return entries
+
+    names = [entry.name.lower() for entry in entries]
+    scores = [0] * len(entries)
+    for token in set(INSTRUCTION_TOKEN_RE.findall(instruction.lower())):
+        matches = [i for i, name in enumerate(names) if token in name]
+        if len(matches) <= len(entries) // 2:
+            for i in matches:
+                scores[i] += 1
+
+    relevant = sorted((i for i, score in enumerate(scores) if score), key=lambda i: -scores[i])
+    chosen = set(relevant[:sample_size // 2])
+    rest = [i for i in range(len(entries)) if i not in chosen]
+    step = len(rest) / (sample_size - len(chosen))
+    chosen.update(rest[int(k * step)] for k in range(sample_size - len(chosen)))
+    return [entries[i] for i in sorted(chosen)]
+
+
+def collect_file_info(
+    entries: List[os.DirEntry],
+    metadata_fields: Optional[Set[str]] = None
+) -> List[Dict[str, Any]]:
+    """
+    Build file info dictionaries for the given entries, in the same order.
+    
+    Args:
+        entries: Directory entries, e.g. from scan_file_entries()
+        metadata_fields: METADATA_FIELDS groups to include (all groups if None)
+    """
+    # stat() is I/O-bound and releases the GIL, so large batches are
+    # stat-ed on a thread pool; small ones stay serial to skip pool overhead.
+    if metadata_fields is None:
+        metadata_fields = set(METADATA_FIELDS)
+    get_info = partial(get_file_info, metadata_fields=metadata_fields)
+    if metadata_fields and len(entries) > PARALLEL_STAT_THRESHOLD:
+        with ThreadPoolExecutor(max_workers=min(32, len(entries))) as executor:
+            return list(executor.map(get_info, entries))
+    return [get_info(entry) for entry in entries]
+
+
+def list_files_in_directory(
+    directory: Path,
+    extensions: Optional[List[str]] = None,
+    metadata_fields: Optional[Set[str]] = None
+) -> List[Dict[str, Any]]:
     """
     List files in the directory with metadata, optionally filtered by extension.
     
     Args:
         directory: Directory to list files from
         extensions: Optional list of extensions to filter (e.g., ['.jpg', '.png'])
+        metadata_fields: METADATA_FIELDS groups to include (all groups if None)
     
     Returns:
-        List of file info dictionaries with 'name' and 'creation_time'
+        List of file info dictionaries with 'name' and the requested metadata, sorted by name
     """
-    file_objects = [f for f in directory.iterdir() if f.is_file()]
+    return collect_file_info(scan_file_entries(directory, extensions), metadata_fields)
+
+
+def scan_directory_names(directory: Path) -> Tuple[Set[str], Set[str]]:
+    """
+    Read the directory once for in-memory existence checks.
     
-    if extensions:
-        # Normalize extensions (ensure they start with .)
-        normalized_exts = [ext if ext.startswith('.') else f'.{ext}' for ext in extensions]
-        file_objects = [f for f in file_objects if f.suffix.lower() in normalized_exts]
-    
-    # Get file info with metadata (all available metadata)
-    files_info = []
-    for f in file_objects:
-        stat = f.stat()
-        files_info.append({
-            "name": f.name,
-            "creation_time": datetime.fromtimestamp(stat.st_ctime).isoformat(),
-            "creation_timestamp": stat.st_ctime,  # Raw timestamp for sorting
-            "modification_time": datetime.fromtimestamp(stat.st_mtime).isoformat(),
-            "modification_timestamp": stat.st_mtime,  # Raw timestamp for sorting
-            "access_time": datetime.fromtimestamp(stat.st_atime).isoformat(),
-            "access_timestamp": stat.st_atime,  # Raw timestamp for sorting
-            "size": stat.st_size,
-            "size_human": f"{stat.st_size:,} bytes"  # Human-readable size
-        })
+    Returns:
+        Tuple of (names of all entries, names of regular files)
+    """
+    names = set()
+    file_names = set()
+    with os.scandir(directory) as it:
+        for entry in it:
+            names.add(entry.name)
+            if entry.is_file(follow_symlinks=False):
+                file_names.add(entry.name)
+    return names, file_names
+
+
+def casefolded_names(directory: Path, names: Set[str]) -> Optional[Set[str]]:
+    """
+    Find out whether the directory's filesystem ignores case (the macOS and
+    Windows defaults), with a single lookup of an existing name in swapped case.
     
-    # Sort by name by default
-    files_info.sort(key=lambda x: x["name"])
+    Returns:
+        The casefolded names if it ignores case (or there is no name to probe
+        with, erring on the safe side), otherwise None
+    """
+    for name in names:
+        swapped = name.swapcase()
+        if swapped != name and swapped.casefold() == name.casefold() and swapped not in names:
+            if not os.path.lexists(os.path.join(os.fspath(directory), swapped)):
+                return None
+            break
+    return {name.casefold() for name in names}
+
+
+def target_exists(old: str, new: str, existing_names: Set[str], folded_names: Optional[Set[str]]) -> bool:
+    """
+    Check whether a rename target is already taken, using the directory listing.
     
-    return files_info
+    On a filesystem that ignores case (folded_names from casefolded_names), a
+    name differing only in case is taken too, except by a case-only rename of
+    the file itself.
+    """
+    if new in existing_names:
+        return True
+    if folded_names is None or new.casefold() == old.casefold():
+        return False
+    return new.casefold() in folded_names
 
 
 def call_llm_for_rename_plan(
     directory: Path,
     instruction: str,
-    files: List[Dict[str, Any]]
+    files: List[Dict[str, Any]],
+    total_files: Optional[int] = None,
+    use_cache: bool = True
 ) -> Dict:
     """
     Call LLM to generate a rename plan based on user instruction and file list.
@@ -111,7 +473,9 @@ def call_llm_for_rename_plan(
     Args:
         directory: Target directory path
         instruction: User's natural language instruction
-        files: List of file info dictionaries with all metadata (name, creation_time, modification_time, access_time, size, etc.)
+        files: List of file info dictionaries with name and any collected metadata (creation_time, modification_time, access_time, size, etc.)
+        total_files: Number of matching files in the directory, if files is only a sample
+        use_cache: Reuse the response to an identical earlier request (--no-cache disables)
     
     Returns:
         Dictionary with 'renames' list containing old/new mappings
@@ -119,15 +483,72 @@ def call_llm_for_rename_plan(
     print("\nContacting LLM to generate rename plan...")
     
     try:
-        # Use the focused LLM interface module - let LLM handle all sorting/ordering decisions
-        plan = get_rename_plan_from_llm(str(directory), instruction, files)
-        return plan
+        # Imported lazily: the OpenAI client stack is heavy and is only needed
+        # once the user has picked a directory and entered an instruction
+        from llm_interface import stream_renames
+
+        # Use the focused LLM interface module - let LLM handle all sorting/ordering decisions.
+        # Renames are streamed so progress shows while the model is still writing the plan;
+        # nothing is executed until the whole plan is validated and confirmed.
+        renames = []
+        progress = sys.stdout.isatty()
+        for item in stream_renames(str(directory), instruction, files, total_files, use_cache=use_cache):
+            renames.append(item)
+            if progress:
+                print(f"\r  {len(renames)} renames received...", end="", flush=True)
+        if progress and renames:
+            print()
+        plan = {"renames": renames}
     except ValueError as e:
         # Re-raise ValueError as-is
         raise
     except Exception as e:
         raise ValueError(f"Error calling LLM: {e}")
 
+    return plan
+
+
+def cached_llm_plan(request: Dict[str, Any]) -> Optional[Dict]:
+    """Return the cached LLM response for a request (see main), if there is one, without calling the LLM."""
+    from llm_interface import cached_rename_plan
+
+    return cached_rename_plan(
+        str(request["directory"]), request["instruction"], request["files_info"], request["file_count"]
+    )
+
+
+def call_llm_batch(requests: List[Dict[str, Any]]) -> List[Union[Dict, ValueError]]:
+    """
+    Plan queued requests with the OpenAI Batch API and wait for the results.
+    
+    Args:
+        requests: Queued requests (see main), each with directory, instruction, files_info and file_count
+    
+    Returns:
+        Rename plans in the same order as requests; a request the API failed
+        has a ValueError in its place
+    """
+    print(f"\nSubmitting {len(requests)} queued requests to the OpenAI Batch API...")
+    try:
+        from llm_interface import poll_batch, submit_batch
+
+        batch_requests = [
+            {
+                "directory": str(request["directory"]),
+                "instruction": request["instruction"],
+                "files": request["files_info"],
+                "total_files": request["file_count"],
+            }
+            for request in requests
+        ]
+        batch_id = submit_batch(batch_requests)
+        print(f"Batch {batch_id} submitted. Waiting for results (this can take a while)...")
+        return poll_batch(batch_id, batch_requests)
+    except ValueError:
+        raise
+    except Exception as e:
+        raise ValueError(f"Error calling LLM: {e}")
+
 
 def validate_rename_plan(
     directory: Path,
@@ -148,8 +569,23 @@ def validate_rename_plan(
 
     cleaned_plan = []
 
-    # Illegal characters for filenames (Windows + Unix)
-    illegal_chars = ['/', '\\', ':', '*', '?', '"', '<', '>', '|', '\x00']
+    # Read the directory once instead of stat-ing every old/new name
+    existing_names, existing_files = scan_directory_names(directory)
+    folded_names = casefolded_names(directory, existing_names)
+
+    # Map each source name to its target once, so permutation checks are O(1).
+    # The first entry wins for duplicate sources, matching a front-to-back scan.
+    rename_map = {}
+    for item in renames:
+        if isinstance(item, dict) and item.get("old") is not None:
+            rename_map.setdefault(item["old"], item.get("new"))
+
+    # Scan all new names for illegal characters in one pass; per-name checks
+    # below only run when this finds something, to report the offending name
+    bulk_new = "\x01".join(
+        item["new"] for item in renames if isinstance(item, dict) and isinstance(item.get("new"), str)
+    )
+    has_illegal = len(bulk_new.translate(ILLEGAL_CHARS_TABLE)) != len(bulk_new)
 
     for item in renames:
         if not isinstance(item, dict):
@@ -162,8 +598,7 @@ def validate_rename_plan(
             raise ValueError(f"Invalid rename entry (missing 'old' or 'new'): {item!r}")
 
         # Check that old file exists
-        old_path = directory / old
-        if not old_path.is_file():
+        if old not in existing_files:
             raise ValueError(f"Old file does not exist: {old}")
 
         # Check for duplicates
@@ -173,27 +608,20 @@ def validate_rename_plan(
             raise ValueError(f"Collision: multiple files want new name '{new}'")
 
         # Check for illegal characters
-        for char in illegal_chars:
-            if char in new:
-                raise ValueError(f"Illegal character '{char}' in new filename: {new}")
+        if has_illegal and len(new.translate(ILLEGAL_CHARS_TABLE)) != len(new):
+            char = next(c for c in new if c in ILLEGAL_CHARS)
+            raise ValueError(f"Illegal character '{char}' in new filename: {new}")
 
         # Check that new name doesn't already exist (unless it's being renamed from something else)
         # This handles swaps/reversals and complex permutations
-        new_path = directory / new
         
         # Check if target is also being renamed (part of a permutation)
-        target_is_also_renamed = False
-        is_swap = False
-        for other_item in renames:
-            if other_item.get("old") == new:
-                target_is_also_renamed = True
-                if other_item.get("new") == old:
-                    is_swap = True  # Circular swap
-                break
+        target_is_also_renamed = new in rename_map
+        is_swap = target_is_also_renamed and rename_map[new] == old  # Circular swap
         
         # Allow if target is also being renamed (permutation) or is a swap
         # But block if target exists and isn't part of the rename operation
-        if new_path.exists() and new not in old_names and not target_is_also_renamed:
+        if new not in old_names and not target_is_also_renamed and target_exists(old, new, existing_names, folded_names):
             raise ValueError(f"Target filename already exists: {new}")
 
         old_names.add(old)
@@ -203,8 +631,14 @@ def validate_rename_plan(
     return cleaned_plan
 
 
-def preview_renames(renames: List[Dict]) -> bool:
-    """Display preview of planned renames and ask for confirmation."""
+def preview_renames(renames: List[Dict], assume_yes: bool = False) -> bool:
+    """
+    Display preview of planned renames and ask for confirmation.
+    
+    Args:
+        renames: Validated rename plan
+        assume_yes: Confirm without prompting (--yes)
+    """
     print("\nPlanned actions:\n")
     if not renames:
         print("No files to rename.")
@@ -217,6 +651,10 @@ def preview_renames(renames: List[Dict]) -> bool:
         new = item["new"]
         print(f"{i:3}. {old.ljust(width)} → {new}")
 
+    if assume_yes:
+        print(f"\nProceeding with these {len(renames)} renames (--yes).")
+        return True
+
     while True:
         choice = input(f"\nProceed with these {len(renames)} renames? [y/N]: ").strip().lower()
         if choice in ("y", "yes"):
@@ -227,6 +665,49 @@ def preview_renames(renames: List[Dict]) -> bool:
             print("Please answer 'y' or 'n'.")
 
 
+def rename_batch(directory: Path, batch: List[Dict], stop_on_error: bool = False) -> List[Optional[Exception]]:
+    """
+    Rename every item in a batch, in parallel for large batches.
+    
+    Items in a batch must be independent (no target is another item's source),
+    which holds within each phase of execute_renames.
+    
+    Args:
+        directory: Directory containing the files
+        batch: {'old', 'new'} renames
+        stop_on_error: Start no further renames once one fails (renames already
+            running in other threads still finish)
+    
+    Returns:
+        One result per item, in order: None on success, the raised exception,
+        or RENAME_SKIPPED for an item skipped because of stop_on_error
+    """
+    # Join every source/target path once, up front, as plain strings
+    dir_str = os.fspath(directory)
+    path_pairs = [
+        (os.path.join(dir_str, item["old"]), os.path.join(dir_str, item["new"]))
+        for item in batch
+    ]
+
+    failed = threading.Event()
+
+    def rename_one(paths: Tuple[str, str]) -> Optional[Exception]:
+        if failed.is_set():
+            return RENAME_SKIPPED
+        try:
+            os.rename(*paths)
+            return None
+        except Exception as e:
+            if stop_on_error:
+                failed.set()
+            return e
+
+    if len(path_pairs) > PARALLEL_RENAME_THRESHOLD:
+        with ThreadPoolExecutor(max_workers=min(16, len(path_pairs))) as executor:
+            return list(executor.map(rename_one, path_pairs))
+    return [rename_one(paths) for paths in path_pairs]
+
+
 def execute_renames(
     directory: Path,
     renames: List[Dict],
@@ -237,124 +718,233 @@ def execute_renames(
     success_count = 0
     error_count = 0
     
+    # Read the directory once instead of probing every target
+    existing_names, _ = scan_directory_names(directory)
+    folded_names = casefolded_names(directory, existing_names)
+
     # Build a mapping for quick lookup
     rename_map = {item["old"]: item["new"] for item in renames}
     
     # Check if we need temp names:
-    # 1. Circular swaps (A→B, B→A)
-    # 2. Target filename already exists (and is also being renamed - complex permutation)
-    needs_temp = False
-    existing_targets = set()
-    
-    for item in renames:
-        old = item["old"]
-        new = item["new"]
-        new_path = directory / new
-        
-        # Check for circular swaps
-        if rename_map.get(new) == old:
-            needs_temp = True
-            break
-        
-        # Check if target already exists
-        if new_path.exists():
-            existing_targets.add(new)
-            # If target exists and is also being renamed, we need temp names
-            if new in rename_map:
-                needs_temp = True
-                break
+    # 1. Swaps/permutations: some target is also a source (A→B, B→A)
+    # 2. Target filename already exists on disk
+    olds = rename_map.keys()
+    news = {item["new"] for item in renames}
+    needs_temp = not news.isdisjoint(olds)
+    existing_targets = {
+        item["new"] for item in renames
+        if item["new"] not in olds and target_exists(item["old"], item["new"], existing_names, folded_names)
+    }
     
     if needs_temp or existing_targets:
-        # Use temporary names for all renames to avoid conflicts
-        import uuid
+        # Use temporary names for all renames to avoid conflicts.
+        # Names are TEMP_PREFIX plus the plan index, so no RNG is needed per file.
         temp_renames = []
         final_renames = []
         
-        for item in renames:
+        for i, item in enumerate(renames):
             old = item["old"]
             new = item["new"]
             
             # Check if target exists or is part of a swap/permutation
-            new_path = directory / new
             is_conflict = (
-                new_path.exists() or  # Target exists
+                new in existing_targets or  # Target exists
                 new in rename_map  # Target is also being renamed (permutation)
             )
             
             if is_conflict:
                 # Use temp name to avoid conflict
-                temp_name = f".temp_{uuid.uuid4().hex[:8]}_{new}"
+                temp_name = f"{TEMP_PREFIX}{i:x}_{new}"
                 temp_renames.append({"old": old, "new": temp_name})
                 final_renames.append({"old": temp_name, "new": new})
             else:
                 # No conflict, can rename directly
                 temp_renames.append(item)
         
-        # Execute temp renames first (move all conflicting files to temp names)
-        for item in temp_renames:
+        # Execute temp renames first (move all conflicting files to temp names).
+        # The whole phase completes before any final rename starts, and stops
+        # at the first failure.
+        moved_to_temp = []
+        skipped_count = 0
+        for item, error in zip(temp_renames, rename_batch(directory, temp_renames, stop_on_error=True)):
             old = item["old"]
             new = item["new"]
-            src = directory / old
-            dst = directory / new
-            try:
-                src.rename(dst)
-                if new.startswith(".temp_"):
-                    logger.info(f"RENAMED (temp): {old} -> {new}")
+            if error is None:
+                if new.startswith(TEMP_PREFIX):
+                    logger.info("RENAMED (temp): %s -> %s", old, new)
+                    moved_to_temp.append(item)
                 else:
                     print(f"[OK] {old} → {new}")
-                    logger.info(f"RENAMED: {old} -> {new}")
+                    logger.info("RENAMED: %s -> %s", old, new)
                     success_count += 1
-            except Exception as e:
-                print(f"[ERR] {old} → {new} ({e})")
-                logger.error(f"FAILED: {old} -> {new}: {e}")
+            elif error is RENAME_SKIPPED:
+                skipped_count += 1
+            else:
+                print(f"[ERR] {old} → {new} ({error})")
+                logger.error("FAILED: %s -> %s: %s", old, new, error)
                 error_count += 1
-                if new.startswith(".temp_"):
-                    # If temp rename failed, abort to avoid leaving files in bad state
-                    return
+
+        if error_count:
+            # Abort, moving files parked under temp names back to their original names
+            print(f"\nAborted: {skipped_count} renames were not attempted.")
+            logger.error("Aborted after a failed temp rename; %d renames not attempted", skipped_count)
+            restores = [{"old": item["new"], "new": item["old"]} for item in moved_to_temp]
+            restored = 0
+            for item, error in zip(restores, rename_batch(directory, restores)):
+                if error is None:
+                    logger.info("RESTORED: %s -> %s", item["old"], item["new"])
+                    restored += 1
+                else:
+                    print(f"[ERR] Could not restore {item['new']}; it is still named {item['old']} ({error})")
+                    logger.error("FAILED to restore: %s -> %s: %s", item["old"], item["new"], error)
+            if restores:
+                print(f"Restored {restored} of {len(restores)} files moved to temporary names.")
+            final_renames = []
         
         # Execute final renames (move from temp names to final names)
-        for item in final_renames:
+        for item, error in zip(final_renames, rename_batch(directory, final_renames)):
             old = item["old"]
             new = item["new"]
-            src = directory / old
-            dst = directory / new
-            try:
-                src.rename(dst)
+            if error is None:
                 print(f"[OK] {old} → {new}")
-                logger.info(f"RENAMED: {old} -> {new}")
+                logger.info("RENAMED: %s -> %s", old, new)
                 success_count += 1
-            except Exception as e:
-                print(f"[ERR] {old} → {new} ({e})")
-                logger.error(f"FAILED: {old} -> {new}: {e}")
+            else:
+                print(f"[ERR] {old} → {new} ({error})")
+                logger.error("FAILED: %s -> %s: %s", old, new, error)
                 error_count += 1
     else:
         # No conflicts, execute normally
-        for item in renames:
+        for item, error in zip(renames, rename_batch(directory, renames)):
             old = item["old"]
             new = item["new"]
-            src = directory / old
-            dst = directory / new
-
-            try:
-                src.rename(dst)
+            if error is None:
                 print(f"[OK] {old} → {new}")
-                logger.info(f"RENAMED: {old} -> {new}")
+                logger.info("RENAMED: %s -> %s", old, new)
                 success_count += 1
-            except Exception as e:
-                print(f"[ERR] {old} → {new} ({e})")
-                logger.error(f"FAILED: {old} -> {new}: {e}")
+            else:
+                print(f"[ERR] {old} → {new} ({error})")
+                logger.error("FAILED: %s -> %s: %s", old, new, error)
                 error_count += 1
 
     print(f"\nDone. {success_count} successful, {error_count} failed.")
-    logger.info(f"Rename operation completed: {success_count} successful, {error_count} failed")
+    logger.info("Rename operation completed: %d successful, %d failed", success_count, error_count)
+    # Write buffered records out now that the files on disk have changed
+    for handler in logger.handlers:
+        handler.flush()
+
+
+def apply_rename_plan(
+    request: Dict[str, Any],
+    raw_plan: Dict,
+    from_template: bool,
+    assume_yes: bool,
+    logger: logging.Logger
+) -> None:
+    """
+    Validate, preview and execute a rename plan for a request.
+    
+    Args:
+        request: The request (see main): directory, instruction, files, files_info, file_count, metadata_fields
+        raw_plan: Plan from the LLM or a template
+        from_template: Whether the plan was built locally rather than by the LLM
+        assume_yes: Confirm without prompting (--yes)
+        logger: Logger for the run
+    """
+    directory = request["directory"]
+    instruction = request["instruction"]
+    files = request["files"]
+    files_info = request["files_info"]
+    file_count = request["file_count"]
+
+    # Step 2: validate plan
+    try:
+        renames = validate_rename_plan(directory, raw_plan)
+        if not renames:
+            print("\nNo files matched your criteria. The LLM returned an empty rename plan.")
+            print(f"Files in directory: {', '.join(files[:10])}{'...' if len(files) > 10 else ''}")
+            logger.info("LLM returned empty rename plan")
+            discard_cached_plan(directory, instruction, files_info, file_count)
+            return
+    except ValueError as e:
+        print(f"\nError in LLM plan: {e}")
+        print(f"\nTip: If you're trying to swap/reverse files, make sure the LLM generates a complete plan.")
+        logger.error("LLM plan validation failed: %s", e)
+        discard_cached_plan(directory, instruction, files_info, file_count)
+        return
+
+    # Step 3: preview & confirm
+    if not preview_renames(renames, assume_yes):
+        print("\nAborted by user. No changes made.")
+        logger.info("User aborted rename operation.")
+        discard_cached_plan(directory, instruction, files_info, file_count)
+        return
+
+    # Step 4: execute
+    execute_renames(directory, renames, logger)
+    if not from_template:
+        learn_template(instruction, files_info, file_count, renames, request["metadata_fields"])
+
+    # Show log file location
+    handler = logger.handlers[0] if logger.handlers else None
+    log_file = getattr(getattr(handler, "target", handler), "baseFilename", "unknown")
+    print(f"Actions logged to {log_file}")
+
+
+def run_queued_requests(queued: List[Dict[str, Any]], assume_yes: bool, logger: logging.Logger) -> None:
+    """Plan the requests queued in --batch mode with one Batch API job, then apply each plan."""
+    try:
+        plans = call_llm_batch(queued)
+    except ValueError as e:
+        print(f"\nError generating rename plans: {e}")
+        logger.error("Batch plan generation failed: %s", e)
+        return
+
+    for request, raw_plan in zip(queued, plans):
+        print(f"\n--- {request['directory']}: {request['instruction']}")
+        if isinstance(raw_plan, ValueError):
+            print(f"\nError generating rename plan: {raw_plan}")
+            logger.error("Batch request failed for %s: %s", request["directory"], raw_plan)
+            continue
+        logger.info("Applying batch plan for %s: %s", request["directory"], request["instruction"])
+        apply_rename_plan(request, raw_plan, False, assume_yes, logger)
+        print()  # Add blank line before next request
 
 
 # ------------- Main entry point -------------
 
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    """Parse command-line options."""
+    parser = argparse.ArgumentParser(description="Rename files from natural-language instructions.")
+    parser.add_argument(
+        "-y", "--yes",
+        action="store_true",
+        help="confirm rename plans without prompting (for scripted runs)",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="always ask the LLM, ignoring cached responses and learned templates "
+             "(instructions that spell out a numbering are still planned locally)",
+    )
+    parser.add_argument(
+        "--batch",
+        action="store_true",
+        help="queue requests until you quit, then plan them together with the OpenAI Batch API "
+             "(about half the cost, but results can take up to 24 hours)",
+    )
+    return parser.parse_args(argv)
+
+
 def main():
     """Main entry point for the file renamer."""
-    # Check for API key
-    if not os.getenv("OPENAI_API_KEY"):
+    args = parse_args()
+
+    # Load environment variables from .env file
+    load_dotenv()
+
+    # Check for API key (OPENAI_API_KEYS may list several instead)
+    if not (os.getenv("OPENAI_API_KEY") or os.getenv("OPENAI_API_KEYS")):
         print("Error: OPENAI_API_KEY environment variable is not set.")
         print("Please set it using:")
         print("  Windows (PowerShell): $env:OPENAI_API_KEY='your_key_here'")
@@ -368,106 +958,119 @@ def main():
     print("AI File Renaming Agent")
     print("=" * 60)
     print("Type 'q' at any prompt to quit.\n")
+    if args.batch:
+        print("Batch mode: requests are queued and planned together when you quit.\n")
+
+    # Requests waiting for the Batch API (--batch)
+    queued: List[Dict[str, Any]] = []
 
     # Main loop - continue until user quits
     while True:
         # Get directory
         directory = ask_directory()
         if directory is None:
+            if queued:
+                run_queued_requests(queued, args.yes, logger)
             print("\nGoodbye!")
             logger.info("User quit the program")
             break
-        logger.info(f"Selected directory: {directory}")
+        logger.info("Selected directory: %s", directory)
 
         # Get instruction
         instruction = ask_instruction()
         if instruction is None:
             print("\nReturning to directory selection...")
             continue
-        logger.info(f"User instruction: {instruction}")
+        logger.info("User instruction: %s", instruction)
+
+        # Scan the instruction once; the hints below are all derived from this
+        keywords = scan_instruction_keywords(instruction)
 
         # Try to extract file extension filter from instruction
-        instruction_lower = instruction.lower()
-        extensions_to_filter = None
-        
-        # Check for common file type mentions
-        if '.jpg' in instruction_lower or 'jpg' in instruction_lower or 'jpeg' in instruction_lower:
-            extensions_to_filter = ['.jpg', '.jpeg']
-        elif '.png' in instruction_lower or 'png' in instruction_lower:
-            extensions_to_filter = ['.png']
-        elif '.txt' in instruction_lower or 'text' in instruction_lower:
-            extensions_to_filter = ['.txt']
-        elif '.pdf' in instruction_lower or 'pdf' in instruction_lower:
-            extensions_to_filter = ['.pdf']
-        # Add more as needed
+        extensions_to_filter = detect_extension_filter(keywords)
+
+        # Only collect the metadata the instruction needs, to keep the prompt small
+        metadata_fields = detect_metadata_fields(keywords)
         
-        # List files (with optional extension filter) - includes all metadata
-        files_info = list_files_in_directory(directory, extensions_to_filter)
-        file_count = len(files_info)
-        logger.info(f"Found {file_count} files in directory" + (f" (filtered by extension: {extensions_to_filter})" if extensions_to_filter else ""))
+        # List files (with optional extension filter) - names only, no stat yet
+        entries = scan_file_entries(directory, extensions_to_filter)
+        file_count = len(entries)
+        if extensions_to_filter:
+            logger.info("Found %d files in directory (filtered by extension: %s)", file_count, extensions_to_filter)
+        else:
+            logger.info("Found %d files in directory", file_count)
         
         # Warn user if directory is very large
-        if file_count > 500:
+        if file_count > LLM_SAMPLE_SIZE:
             print(f"\n⚠ Warning: Large directory detected ({file_count} files).")
             print("Processing all files, but the LLM will see a sample to avoid token limits.")
             print("The pattern will be applied to all matching files.")
-            response = input("Continue? [Y/n]: ").strip().lower()
-            if response == 'n':
-                print("Aborted.")
-                print()  # Add blank line before next iteration
-                continue
+            if args.yes or not sys.stdin.isatty():
+                # Scripted run: nobody to answer, so don't block on the prompt
+                logger.info("Non-interactive: proceeding with %d files", file_count)
+            else:
+                response = input("Continue? [Y/n]: ").strip().lower()
+                if response == 'n':
+                    print("Aborted.")
+                    print()  # Add blank line before next iteration
+                    continue
         
         # Extract just filenames for logging/display
-        files = [f["name"] for f in files_info]
+        files = [entry.name for entry in entries]
 
         if not files:
             print("No files found in that directory.")
             print()  # Add blank line before next iteration
             continue
 
-        # Step 1: get plan from LLM
+        # Only stat the files the LLM will actually see
+        files_info = collect_file_info(select_sample_entries(entries, instruction, LLM_SAMPLE_SIZE), metadata_fields)
+
+        request = {
+            "directory": directory,
+            "instruction": instruction,
+            "files": files,
+            "files_info": files_info,
+            "file_count": file_count,
+            "metadata_fields": metadata_fields,
+        }
+
+        # Step 1: get plan - from a learned template if one fits, otherwise from the LLM
+        raw_plan = plan_from_template(instruction, files_info, file_count, use_learned=not args.no_cache)
+        from_template = raw_plan is not None
+        if not from_template and args.batch and not args.no_cache:
+            # A request answered before is applied now rather than queued
+            raw_plan = cached_llm_plan(request)
+            if raw_plan is not None:
+                print("\nUsing the cached rename plan for this request (no LLM call).")
+                logger.info("Rename plan served from the LLM response cache")
+        if raw_plan is None and args.batch:
+            queued.append(request)
+            print(f"\nQueued for batch planning ({len(queued)} queued). Enter 'q' at the directory prompt to submit.")
+            logger.info("Queued request for batch planning (%d queued)", len(queued))
+            print()  # Add blank line before next iteration
+            continue
         try:
-            raw_plan = call_llm_for_rename_plan(directory, instruction, files_info)
+            if from_template:
+                print("\nBuilt rename plan locally from the instruction pattern (no LLM call).")
+                logger.info("Rename plan generated locally from template")
+            elif raw_plan is None:
+                raw_plan = call_llm_for_rename_plan(
+                    directory, instruction, files_info, file_count, use_cache=not args.no_cache
+                )
         except ValueError as e:
             print(f"\nError generating rename plan: {e}")
-            logger.error(f"LLM plan generation failed: {e}")
+            logger.error("LLM plan generation failed: %s", e)
             print()  # Add blank line before next iteration
             continue
         except Exception as e:
             print(f"\nUnexpected error: {e}")
-            logger.error(f"Unexpected error in LLM call: {e}", exc_info=True)
+            logger.error("Unexpected error in LLM call: %s", e, exc_info=True)
             print()  # Add blank line before next iteration
             continue
 
-        # Step 2: validate plan
-        try:
-            renames = validate_rename_plan(directory, raw_plan)
-            if not renames:
-                print("\nNo files matched your criteria. The LLM returned an empty rename plan.")
-                print(f"Files in directory: {', '.join(files[:10])}{'...' if len(files) > 10 else ''}")
-                logger.info("LLM returned empty rename plan")
-                print()  # Add blank line before next iteration
-                continue
-        except ValueError as e:
-            print(f"\nError in LLM plan: {e}")
-            print(f"\nTip: If you're trying to swap/reverse files, make sure the LLM generates a complete plan.")
-            logger.error(f"LLM plan validation failed: {e}")
-            print()  # Add blank line before next iteration
-            continue
-
-        # Step 3: preview & confirm
-        if not preview_renames(renames):
-            print("\nAborted by user. No changes made.")
-            logger.info("User aborted rename operation.")
-            print()  # Add blank line before next iteration
-            continue
-
-        # Step 4: execute
-        execute_renames(directory, renames, logger)
-        
-        # Show log file location
-        log_file = logger.handlers[0].baseFilename if logger.handlers else "unknown"
-        print(f"Actions logged to {log_file}")
+        # Steps 2-4: validate, preview & confirm, execute
+        apply_rename_plan(request, raw_plan, from_template, args.yes, logger)
         print()  # Add blank line before next iteration
 
 
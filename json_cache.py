@@ -0,0 +1,60 @@
+"""JSON cache files - small on-disk key/value caches shared by the renamer and the LLM interface."""
+import os
+import json
+import logging
+from pathlib import Path
+from typing import Any, Dict
+
+try:
+    import orjson  # Optional: faster loading and saving of large caches
+except ImportError:
+    orjson = None
+
+# Entries kept per cache file; the oldest are dropped first
+CACHE_MAX_ENTRIES = 100
+
+# JSON cache files already loaded into memory, by path
+_json_caches: Dict[Path, Dict[str, Any]] = {}
+
+
+def load_json_cache(path: Path) -> Dict[str, Any]:
+    """Load a JSON cache file once; a missing or corrupt file starts empty."""
+    if path not in _json_caches:
+        try:
+            with open(path, "rb") as f:
+                raw = f.read()
+        except OSError:
+            raw = b""
+        cache = {}
+        if raw:
+            try:
+                cache = orjson.loads(raw) if orjson is not None else json.loads(raw)
+            except ValueError:
+                # orjson rejects escaped lone surrogates (file names that are not UTF-8); the stdlib accepts them
+                try:
+                    cache = json.loads(raw)
+                except ValueError:
+                    pass
+        _json_caches[path] = cache if isinstance(cache, dict) else {}
+    return _json_caches[path]
+
+
+def save_json_cache(path: Path) -> None:
+    """Write a JSON cache file to disk, keeping only the newest entries."""
+    cache = load_json_cache(path)
+    while len(cache) > CACHE_MAX_ENTRIES:
+        del cache[next(iter(cache))]
+    tmp_path = path.with_suffix(".tmp")
+    try:
+        path.parent.mkdir(exist_ok=True)
+        try:
+            data = orjson.dumps(cache) if orjson is not None else None
+        except TypeError:
+            data = None  # Lone surrogates from file names that are not UTF-8; the stdlib escapes them
+        if data is None:
+            data = json.dumps(cache).encode("utf-8")
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logging.getLogger("ai_file_renamer").warning("Could not save %s: %s", path, e)
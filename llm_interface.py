@@ -1,11 +1,32 @@
 """LLM Interface for file renaming - focused module using OpenAI's GPT-5.1 model."""
 import os
+import asyncio
+import copy
+import hashlib
 import json
+import logging
+import random
+import re
+import threading
 import time
-from typing import List, Dict
+import weakref
+from email.utils import parsedate_to_datetime
+from functools import lru_cache
+from importlib.util import find_spec
+from itertools import islice
+from pathlib import Path
+from typing import Any, Final, Iterable, Iterator, List, Dict, Optional, Tuple, Union
+import httpx
 from dotenv import load_dotenv
-from openai import OpenAI
-from openai import RateLimitError, APIError
+from openai import AsyncOpenAI, OpenAI
+from openai import RateLimitError, APIConnectionError, APIError
+
+from json_cache import load_json_cache, save_json_cache
+
+try:
+    import orjson  # Optional: faster JSON for prompts and LLM responses
+except ImportError:
+    orjson = None
 
 # Load environment variables from .env file
 load_dotenv()
@@ -13,9 +34,159 @@ load_dotenv()
 # Use OpenAI's GPT-5.1 model for JSON planning
 MODEL_NAME = os.getenv("OPENAI_MODEL", "gpt-5.1")  # Default to gpt-5.1
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# Connection pool for the shared client: idle connections are kept open for
+# reuse by later requests and retries, for up to KEEPALIVE_EXPIRY seconds
+MAX_CONNECTIONS = 32
+MAX_KEEPALIVE_CONNECTIONS = 16
+KEEPALIVE_EXPIRY = 60
+# Seconds to wait for a response (large plans take a while) and to connect
+REQUEST_TIMEOUT = 300
+CONNECT_TIMEOUT = 10
+
+# Attempts per request. Retries wait a random time between BASE_RETRY_DELAY and
+# an exponentially growing cap (at most MAX_RETRY_DELAY), unless the server says
+# how long to wait with Retry-After
+MAX_RETRIES = 6
+BASE_RETRY_DELAY = 1
+MAX_RETRY_DELAY = 60
+# Besides rate limits, connection failures and timeouts, these statuses are
+# transient (request timeout, conflict) and retried, as are all 5xx errors
+RETRYABLE_STATUS_CODES = (408, 409)
+# Requests get_rename_plans_concurrent keeps in flight at once by default
+MAX_CONCURRENT_REQUESTS = 8
+# Requests get_rename_plans_batched packs into one call; answers degrade with more
+MAX_JOBS_PER_CALL = 8
+# Seconds between status checks while waiting for a Batch API job
+BATCH_POLL_INTERVAL = 30
+# Batch API job states that will never produce output
+BATCH_FAILED_STATES = ("failed", "expired", "cancelled")
+
+# Async client pools by event loop, since an httpx.AsyncClient cannot be shared across loops
+_async_client_pools: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, ClientPool]" = weakref.WeakKeyDictionary()
+
+
+def api_keys() -> List[str]:
+    """
+    Return the API keys to spread requests over: OPENAI_API_KEYS (comma-separated,
+    e.g. keys of several organizations) if set, otherwise OPENAI_API_KEY.
+    """
+    keys = [key.strip() for key in os.getenv("OPENAI_API_KEYS", "").split(",") if key.strip()]
+    if not keys and os.getenv("OPENAI_API_KEY"):
+        keys.append(os.getenv("OPENAI_API_KEY"))
+    return keys
+
+
+class ClientPool:
+    """
+    One client per API key, each with its own rate limit.
+    
+    Requests take turns across the clients that are ready; a client that was
+    rate limited sits out its back-off while the others carry on, so several
+    keys give several times the throughput of one.
+    """
+
+    def __init__(self, clients: List[Any]):
+        if not clients:
+            raise ValueError("OPENAI_API_KEY environment variable is not set")
+        self.clients = clients
+        # time.monotonic() at which each client may be used again
+        self.ready_at = [0.0] * len(clients)
+        self._turn = 0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> Tuple[int, float]:
+        """
+        Pick the next client to use: the next ready one in turn, or the one ready soonest.
+        
+        Returns:
+            Tuple of (client index, seconds to wait before sending, 0 if it is ready)
+        """
+        with self._lock:
+            now = time.monotonic()
+            count = len(self.clients)
+            start = self._turn
+            self._turn = (start + 1) % count
+            index = min(((start + i) % count for i in range(count)), key=lambda i: max(self.ready_at[i], now))
+            return index, max(0.0, self.ready_at[index] - now)
+
+    def backoff(self, index: int, error: Exception, attempt: int) -> float:
+        """
+        Record a failed request on a client and decide how long to wait.
+        
+        A rate-limited client cools down for the retry_delay; the wait is only
+        until some client is ready again, which is no wait at all when another
+        key is still free. Other retryable errors wait the full retry_delay.
+        
+        Returns:
+            Seconds to wait before the next attempt
+        
+        Raises:
+            ValueError: If the error is not retryable, the retries are used up,
+                or the wait would exceed MAX_RETRY_DELAY (every key is cooling
+                down for longer than that)
+        """
+        delay = retry_delay(error, attempt)
+        if isinstance(error, RateLimitError):
+            with self._lock:
+                now = time.monotonic()
+                self.ready_at[index] = now + delay
+                wait = max(0.0, min(self.ready_at) - now)
+        else:
+            wait = delay
+        if wait > MAX_RETRY_DELAY:
+            raise ValueError(f"The server asked to retry after {wait:.0f}s: {error}")
+        logger.warning("LLM request failed (%s); retry %d of %d in %.1fs", error, attempt + 1, MAX_RETRIES - 1, wait)
+        return wait
+
+
+def http_client_options() -> Dict[str, Any]:
+    """Connection pool settings shared by the sync and async httpx clients."""
+    return {
+        "http2": find_spec("h2") is not None,
+        "limits": httpx.Limits(
+            max_connections=MAX_CONNECTIONS,
+            max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=KEEPALIVE_EXPIRY,
+        ),
+        "timeout": httpx.Timeout(REQUEST_TIMEOUT, connect=CONNECT_TIMEOUT),
+    }
+
+
+@lru_cache(maxsize=None)
+def get_client_pool() -> ClientPool:
+    """
+    Return the shared pool of OpenAI clients, creating it on first use.
+    
+    All clients share one connection pool, so retries and later requests reuse
+    the open TLS connection whichever key they go out with. HTTP/2 is enabled
+    when the optional h2 package is installed.
+    """
+    http_client = httpx.Client(**http_client_options())
+    # max_retries=0: retries are handled by ClientPool.backoff, not stacked on the SDK's own
+    return ClientPool([OpenAI(api_key=key, http_client=http_client, max_retries=0) for key in api_keys()])
+
+
+def get_client() -> OpenAI:
+    """Return the client for the first API key (Batch API jobs stay with the key that submitted them)."""
+    return get_client_pool().clients[0]
+
 
-SYSTEM_PROMPT = """You are an AI assistant that generates SAFE file rename plans based on user instructions.
+def get_async_client_pool() -> ClientPool:
+    """Return the pool of AsyncOpenAI clients shared by all requests on the running event loop."""
+    loop = asyncio.get_running_loop()
+    if loop not in _async_client_pools:
+        http_client = httpx.AsyncClient(**http_client_options())
+        _async_client_pools[loop] = ClientPool([
+            AsyncOpenAI(api_key=key, http_client=http_client, max_retries=0) for key in api_keys()
+        ])
+    return _async_client_pools[loop]
+
+
+# The system prompt is sent first and byte-identical on every call, so the API's
+# prompt caching can reuse it; anything request-specific belongs in the user
+# message. Editing it invalidates that cache (and this module's response cache),
+# so keep edits rare.
+SYSTEM_PROMPT: Final[str] = """You are an AI assistant that generates SAFE file rename plans based on user instructions.
 
 You must ONLY return JSON in the following format:
 
@@ -27,14 +198,17 @@ You must ONLY return JSON in the following format:
 }
 
 Core Rules:
-1. Every "old" filename must exactly match one of the filenames in the provided files list (use the "name" field from file objects).
+1. Every "old" filename must exactly match one of the filenames in the provided files list (the "name" column of "files").
 2. "new" filenames must be valid (no slashes, path separators, or illegal characters).
 3. Do NOT invent files that do not exist in the provided list.
 4. Find ALL files that match the user's criteria - be thorough and check every file.
 5. If a warning says only some files are shown, apply the instruction pattern to ALL files in the directory (extrapolate the pattern).
 6. Preserve file extensions unless the user explicitly asks to change them.
 7. Preserve the exact format of numbers/patterns from original filenames (including leading zeros, underscores, etc.) unless the user wants them changed.
-8. Each file object includes complete metadata: creation_time, modification_time, access_time, size, and size_human. 
+8. "files" is a table: files.columns lists the field names once, and each entry of files.rows is one file, with
+   files.rows[i][k] holding the value of field files.columns[k]. Besides "name", the columns include the metadata relevant
+   to the instruction: some or all of creation_time, modification_time, access_time (Unix timestamps in whole seconds;
+   larger is newer) and size (in bytes).
    YOU must analyze the user's instruction and determine:
    - What sorting/ordering criteria to use (date, size, etc.)
    - Which metadata field to use (creation_time, modification_time, access_time, or size)
@@ -54,124 +228,849 @@ Follow the user's instruction precisely and apply it to all matching files. Hand
 
 Do NOT include explanations, comments, or any other text outside the JSON."""
 
+# Extra instructions for requests that pack several jobs into one call
+BATCH_SYSTEM_PROMPT: Final[str] = """This request contains several independent jobs: {"jobs": [{"id": ..., "directory": ..., "instruction": ..., "files": ..., "warning": ...}, ...]}.
+Apply all the rules above to each job separately, using only that job's instruction and files.
+
+Return ONLY JSON in this format, with one entry per job:
+
+{
+  "results": [
+    { "id": "job id", "renames": [ { "old": "old_filename.ext", "new": "new_filename.ext" }, ... ] },
+    ...
+  ]
+}"""
+
 
 # Maximum number of files to send to LLM in one request
 MAX_FILES_FOR_LLM = 500
 
-def build_user_prompt(directory: str, instruction: str, files: List) -> str:
+# LLM responses from previous requests, keyed by model, system prompt and user prompt
+PLAN_CACHE_PATH = Path("logs") / ".plan_cache.json"
+
+# Words dropped when matching reworded requests against the cache. Words that
+# change the meaning (field, direction, pattern) are never dropped or merged.
+FILLER_WORDS = frozenset({'please', 'kindly', 'can', 'could', 'would', 'you', 'the', 'a', 'an', 'my', 'all'})
+# Interchangeable verbs for asking to sort
+SORT_SYNONYMS = {'sort': 'order', 'sorted': 'ordered', 'arrange': 'order', 'arranged': 'ordered'}
+# Words of the instruction's own phrasing, matched ignoring case and surrounding
+# punctuation. Any other word may be part of a file name or pattern and is kept as written.
+INSTRUCTION_WORDS = frozenset({
+    'rename', 'renumber', 'number', 'numbered', 'order', 'ordered', 'files', 'file', 'them',
+    'to', 'as', 'into', 'by', 'in', 'and', 'then', 'with', 'from', 'of',
+    'date', 'time', 'created', 'creation', 'modified', 'modification', 'accessed', 'access',
+    'last', 'size', 'name', 'oldest', 'newest', 'smallest', 'largest', 'biggest', 'first',
+    'ascending', 'descending', 'reverse', 'reversed',
+})
+# Sentence punctuation stripped from filler and instruction words (never from other words)
+WORD_PUNCTUATION = ',;:!?.'
+# Words carrying quotes or brackets are literal text (e.g. 'The'), kept exactly as written,
+# as is every word between an opening and closing quote
+LITERAL_MARKS = '"\'()[]{}'
+
+
+# Sent with every request so the API routes them to the same cached system prompt prefix
+PROMPT_CACHE_KEY: Final[str] = "ai-file-renamer-v1"
+
+# Start of the "renames" array in a streamed reply
+RENAMES_ARRAY_RE = re.compile(r'"renames"\s*:\s*\[')
+
+# Child of the renamer's logger, so records land in the same log file
+logger = logging.getLogger("ai_file_renamer.llm_interface")
+
+
+def parse_json(content: str) -> Any:
+    """Parse a JSON string, using orjson when installed and the stdlib otherwise."""
+    if orjson is not None:
+        try:
+            return orjson.loads(content)
+        except orjson.JSONDecodeError:
+            pass  # orjson rejects escaped lone surrogates (file names that are not UTF-8); the stdlib accepts them
+    return json.loads(content)
+
+
+def to_table(files_data: List[Dict]) -> Dict[str, List]:
     """
-    Create a structured prompt that we send to the model.
+    Convert a list of per-file dicts into a table: the field names once in
+    "columns", then one row of values per file in "rows".
+    
+    Fields missing from a file are filled with None so every row has one
+    value per column, and rows keep the original file order.
+    """
+    keys: Dict[str, None] = {}
+    for f in files_data:
+        keys.update(dict.fromkeys(f))
+    columns = list(keys)
+    return {"columns": columns, "rows": [[f.get(key) for key in columns] for f in files_data]}
+
+
+def build_prompt_payload(directory: str, instruction: str, files: List, total_files: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Create the structured request data for one directory and instruction.
     
     Args:
         directory: Directory path
         instruction: User's natural language instruction
         files: List of file info (dicts with 'name', 'creation_time', etc.) or just filenames
+        total_files: Number of matching files in the directory, if files is only a sample
     
     Returns:
-        JSON string containing the prompt data
+        Dictionary with directory, instruction, the files table and any truncation warning
     """
-    # Handle both old format (list of strings) and new format (list of dicts)
+    # Limit files sent to LLM to avoid token limits
+    shown = min(len(files), MAX_FILES_FOR_LLM)
+    if total_files is None or total_files < len(files):
+        total_files = len(files)
+    
+    # Handle both old format (list of strings) and new format (list of dicts).
+    # Neither copies the caller's list unless it has to be cut down.
     if files and isinstance(files[0], dict):
         # New format with metadata
-        files_data = files
+        table = to_table(files if shown == len(files) else files[:shown])
     else:
-        # Old format - just filenames
-        files_data = [{"name": f} for f in files]
-    
-    # Limit files sent to LLM to avoid token limits
-    total_files = len(files_data)
-    if total_files > MAX_FILES_FOR_LLM:
-        files_data = files_data[:MAX_FILES_FOR_LLM]
-        files_truncated = True
-    else:
-        files_truncated = False
+        # Old format - just filenames, straight into a one-column table
+        table = {"columns": ["name"], "rows": [[name] for name in islice(files, shown)]}
     
     payload = {
         "directory": directory,
         "instruction": instruction,
-        "files": files_data,
+        # Sent as a table so each field name appears once rather than once per file
+        "files": table,
     }
     
     # Add warning if files were truncated
-    if files_truncated:
-        payload["warning"] = f"Only showing first {MAX_FILES_FOR_LLM} of {total_files} files. Apply the instruction pattern to ALL {total_files} files in the directory."
+    if total_files > shown:
+        payload["warning"] = f"Only showing a sample of {shown} of {total_files} files. Apply the instruction pattern to ALL {total_files} files in the directory."
+    
+    # All metadata is already included in the table - let the LLM analyze and decide how to sort/order
+    
+    return payload
+
+
+def to_prompt_json(data: Any) -> str:
+    """
+    Serialize data for a prompt as compact JSON: indentation costs tokens and tells the model nothing.
+    
+    Uses orjson when installed. For the strings, integers, booleans and None
+    that prompts hold, both give the same text, so cache keys do not depend on it.
+    File names that are not valid UTF-8 are read from disk with lone surrogates
+    (e.g. U+DCFF), which cannot be encoded as UTF-8; such prompts are sent
+    with non-ASCII characters escaped instead.
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(data).decode("utf-8")
+        except TypeError:
+            pass  # Lone surrogates; the stdlib can escape them
+    text = json.dumps(data, separators=(",", ":"), ensure_ascii=False)
+    try:
+        text.encode("utf-8")
+    except UnicodeEncodeError:
+        return json.dumps(data, separators=(",", ":"))
+    return text
+
+
+def build_user_prompt(directory: str, instruction: str, files: List, total_files: Optional[int] = None) -> str:
+    """
+    Create a structured prompt that we send to the model.
+    
+    Returns:
+        JSON string containing the prompt data (see build_prompt_payload)
+    """
+    return to_prompt_json(build_prompt_payload(directory, instruction, files, total_files))
+
+
+def response_cache_key(user_prompt: str) -> str:
+    """Hash everything that determines the LLM's answer: model, system prompt and user prompt."""
+    digest = hashlib.blake2b(digest_size=16)
+    for part in (MODEL_NAME, SYSTEM_PROMPT, user_prompt):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+
+def canonical_instruction(instruction: str) -> str:
+    """
+    Reduce an instruction to a canonical wording for near-duplicate cache lookups.
+    
+    Drops filler words, maps sort verbs to "order", and lowercases and strips
+    punctuation from the words in INSTRUCTION_WORDS, so "Please sort the jpg files
+    by size." and "order jpg files by size" share an entry. Every other word is
+    kept exactly as written, since it may be a file name or pattern:
+    "IMG_#.jpg" and "img_#.jpg" stay distinct, and so do quoted words like
+    'The' and 'the' (see LITERAL_MARKS).
+    """
+    words = []
+    quote = None  # Closing quote of the quoted text being copied, if any
+    for token in instruction.split():
+        if quote is not None:
+            words.append(token)
+            if token.rstrip(WORD_PUNCTUATION + ')]}').endswith(quote):
+                quote = None
+            continue
+        if any(c in LITERAL_MARKS for c in token):
+            words.append(token)
+            # An opening quote without its closing quote continues into the next words
+            head = token.lstrip('([{').rstrip(WORD_PUNCTUATION + ')]}')
+            if head[:1] in ('"', "'") and (len(head) == 1 or not head.endswith(head[0])):
+                quote = head[0]
+            continue
+        word = token.strip(WORD_PUNCTUATION).lower()
+        if word in FILLER_WORDS:
+            continue
+        if word in SORT_SYNONYMS or word in INSTRUCTION_WORDS:
+            words.append(SORT_SYNONYMS.get(word, word))
+        else:
+            words.append(token)
+    return " ".join(words)
+
+
+def near_duplicate_key(directory: str, instruction: str, files: List, total_files: Optional[int] = None) -> str:
+    """Cache key shared by rewordings of the same request on the same file listing."""
+    canonical_prompt = build_user_prompt(directory, canonical_instruction(instruction), files, total_files)
+    return "near:" + response_cache_key(canonical_prompt)
+
+
+def discard_cached_response(
+    directory: str,
+    instruction: str,
+    files: List,
+    total_files: Optional[int] = None
+) -> None:
+    """Forget the cached response for a request, so the next identical request calls the LLM."""
+    cache = load_json_cache(PLAN_CACHE_PATH)
+    exact_key = response_cache_key(build_user_prompt(directory, instruction, files, total_files))
+    # The near-duplicate entry points at the exact key of the response it served
+    served_key = cache.pop(near_duplicate_key(directory, instruction, files, total_files), None)
+    removed = [cache.pop(key, None) for key in (exact_key, served_key) if key is not None]
+    if served_key is not None or any(entry is not None for entry in removed):
+        save_json_cache(PLAN_CACHE_PATH)
+
+
+def lookup_cached_response(cache_key: str, near_key: str) -> Optional[Dict]:
+    """Return a copy of the cached response for a request or a rewording of it, if any."""
+    cache = load_json_cache(PLAN_CACHE_PATH)
+    if cache_key in cache:
+        logger.info("LLM cache hit: %s", cache_key)
+        return copy.deepcopy(cache[cache_key])
+    served_key = cache.get(near_key)
+    if served_key in cache:
+        logger.info("LLM cache hit for reworded instruction: %s", served_key)
+        return copy.deepcopy(cache[served_key])
+    return None
+
+
+def store_cached_response(cache_key: str, near_key: str, data: Dict) -> None:
+    """Cache a well-formed response under its exact and near-duplicate keys."""
+    cache = load_json_cache(PLAN_CACHE_PATH)
+    cache[cache_key] = copy.deepcopy(data)
+    cache[near_key] = cache_key
+    save_json_cache(PLAN_CACHE_PATH)
+
+
+def build_messages(user_prompt: str, batched: bool = False) -> List[Dict[str, str]]:
+    """
+    Chat messages for a rename plan request.
+    
+    Batched requests add BATCH_SYSTEM_PROMPT after SYSTEM_PROMPT rather than
+    editing it, so the shared system prompt stays byte-identical across calls.
+    """
+    messages = [{"role": "system", "content": SYSTEM_PROMPT}]
+    if batched:
+        messages.append({"role": "system", "content": BATCH_SYSTEM_PROMPT})
+    messages.append({"role": "user", "content": user_prompt})
+    return messages
+
+
+def completion_params(messages: List[Dict[str, str]]) -> Dict[str, Any]:
+    """Keyword arguments for chat.completions.create, shared by every request path."""
+    return {
+        "model": MODEL_NAME,
+        "messages": messages,
+        "temperature": 0.2,  # keep it deterministic-ish
+        "response_format": {"type": "json_object"},  # ask for valid JSON
+        # Same key on every request so they are routed to the same prompt cache;
+        # sent via extra_body so SDK versions without the parameter pass it through
+        "extra_body": {"prompt_cache_key": PROMPT_CACHE_KEY},
+    }
+
+
+def batch_request_body(messages: List[Dict[str, str]]) -> Dict[str, Any]:
+    """Request body for one Batch API line: completion_params as plain JSON fields."""
+    params = completion_params(messages)
+    extra_body = params.pop("extra_body")
+    return {**params, **extra_body}
+
+
+def parse_plan_content(content: Optional[str]) -> Optional[Dict]:
+    """
+    Parse the model's reply into a plan.
     
-    # All metadata is already included in files_data - let the LLM analyze and decide how to sort/order
+    Returns:
+        Plan dictionary, or None if the reply is not JSON with a 'renames' list
+    """
+    # `content` should be a JSON string
+    try:
+        data = parse_json(content)
+    except (json.JSONDecodeError, TypeError):
+        return None
+    # Ensure the shape is at least predictable
+    if not isinstance(data, dict) or not isinstance(data.get("renames"), list):
+        return None
+    return data
+
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    """Read how long the server asked us to wait from an error response's Retry-After headers."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return float(retry_after_ms) / 1000
+        except ValueError:
+            pass
+    retry_after = headers.get("retry-after")
+    if not retry_after:
+        return None
+    try:
+        return float(retry_after)
+    except ValueError:
+        pass
+    # Retry-After may also be an HTTP date
+    try:
+        return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def retry_delay(error: Exception, attempt: int) -> float:
+    """
+    Decide whether a failed request should be retried, and how long the client
+    that sent it should wait (ClientPool.backoff decides the actual wait).
+    
+    Waits are randomized (exponential backoff with jitter) so concurrent
+    clients that were rate limited together do not retry together. A Retry-After
+    from the server is honored as is, even beyond MAX_RETRY_DELAY.
+    
+    Returns:
+        Seconds the client should wait before its next attempt
+    
+    Raises:
+        ValueError: If the error is not retryable or the retries are used up
+    """
+    rate_limited = isinstance(error, RateLimitError)
+    # Retry on rate limits, network errors and timeouts (APIConnectionError covers
+    # APITimeoutError), 408/409 and server errors (5xx); other API errors are not transient
+    status_code = getattr(error, "status_code", None)
+    transient = (
+        rate_limited
+        or isinstance(error, APIConnectionError)
+        or (status_code is not None and (status_code in RETRYABLE_STATUS_CODES or status_code >= 500))
+    )
+    if not transient:
+        raise ValueError(f"LLM API error: {error}")
+    if attempt >= MAX_RETRIES - 1:
+        if rate_limited:
+            raise ValueError(f"Rate limit exceeded after {MAX_RETRIES} attempts: {error}")
+        raise ValueError(f"LLM API error: {error}")
+
+    delay = retry_after_seconds(error)
+    if delay is None:
+        cap = min(MAX_RETRY_DELAY, BASE_RETRY_DELAY * 2 ** (attempt + 1))
+        delay = random.uniform(BASE_RETRY_DELAY, cap)
+    return delay
+
+
+def is_trivial_request(instruction: str, files: List) -> bool:
+    """
+    Return True if a request has nothing for the model to do: no files to
+    rename, or an empty instruction. Its plan is always empty.
+    """
+    if not files or not instruction.strip():
+        logger.info("Skipping LLM call: %s", "no files" if not files else "empty instruction")
+        return True
+    return False
+
+
+def prepare_request(
+    directory: str,
+    instruction: str,
+    files: List,
+    total_files: Optional[int] = None,
+    use_cache: bool = True
+) -> Tuple[Optional[Dict], str, str, str]:
+    """
+    Do everything a request needs before calling the LLM: skip trivial requests,
+    build the user prompt and its cache keys, and look up a cached response.
     
-    return json.dumps(payload, indent=2)
+    Returns:
+        Tuple of (plan to return without calling the LLM, or None; user prompt;
+        exact cache key; near-duplicate cache key). The strings are empty when
+        the request is trivial.
+    """
+    if is_trivial_request(instruction, files):
+        return {"renames": []}, "", "", ""
+
+    user_prompt = build_user_prompt(directory, instruction, files, total_files)
+    cache_key = response_cache_key(user_prompt)
+    near_key = near_duplicate_key(directory, instruction, files, total_files)
+    cached = lookup_cached_response(cache_key, near_key) if use_cache else None
+    return cached, user_prompt, cache_key, near_key
 
 
 def get_rename_plan_from_llm(
     directory: str,
     instruction: str,
-    files: List
+    files: List,
+    total_files: Optional[int] = None,
+    use_cache: bool = True
 ) -> Dict:
     """
     Call the LLM and return a Python dict like:
     { "renames": [ { "old": "...", "new": "..." }, ... ] }
     
+    Responses are cached on disk, so an identical request (same model, prompt,
+    directory, instruction and file listing) skips the API call. A request that
+    only rewords the instruction (see canonical_instruction) reuses it too.
+    
     Args:
         directory: Directory path
         instruction: User's natural language instruction
         files: List of file info (dicts with 'name', 'creation_time', etc.) or just filenames
+        total_files: Number of matching files in the directory, if files is only a sample
+        use_cache: Return a cached response if there is one (a fresh response is cached either way)
     
     Returns:
         Dictionary with 'renames' list containing old/new mappings
     """
-    if not os.getenv("OPENAI_API_KEY"):
-        raise ValueError("OPENAI_API_KEY environment variable is not set")
-    
-    user_prompt = build_user_prompt(directory, instruction, files)
+    plan, user_prompt, cache_key, near_key = prepare_request(directory, instruction, files, total_files, use_cache)
+    if plan is not None:
+        return plan
+
+    data = parse_plan_content(request_completion(build_messages(user_prompt)))
+    if data is None:
+        # Fallback: if somehow it returns junk, fail safely
+        return {"renames": []}
+    store_cached_response(cache_key, near_key, data)
+    return data
+
 
-    # Retry logic for rate limiting and transient errors
-    max_retries = 3
-    base_delay = 1  # seconds
+def create_completion(params: Dict[str, Any]) -> Any:
+    """
+    Create a chat completion (or open a stream, with stream=True in params) on
+    the client pool, retrying rate limits and transient errors on the next
+    client in turn.
+    
+    Returns:
+        The SDK's response (or stream)
     
-    for attempt in range(max_retries):
+    Raises:
+        ValueError: If the API key is missing or the request keeps failing
+    """
+    if not api_keys():
+        raise ValueError("OPENAI_API_KEY environment variable is not set")
+
+    pool = get_client_pool()
+    for attempt in range(MAX_RETRIES):
+        index, wait = pool.acquire()
+        if wait:
+            time.sleep(wait)  # Every key is cooling down
         try:
-            response = client.chat.completions.create(
-                model=MODEL_NAME,
-                messages=[
-                    {"role": "system", "content": SYSTEM_PROMPT},
-                    {"role": "user", "content": user_prompt},
-                ],
-                temperature=0.2,  # keep it deterministic-ish
-                response_format={"type": "json_object"},  # ask for valid JSON
-            )
+            return pool.clients[index].chat.completions.create(**params)
+        except APIError as e:
+            time.sleep(pool.backoff(index, e, attempt))
 
-            content = response.choices[0].message.content
-            # `content` should be a JSON string
-            try:
-                data = json.loads(content)
-            except json.JSONDecodeError:
-                # Fallback: if somehow it returns junk, fail safely
-                return {"renames": []}
+    # Should not reach here, but just in case
+    raise ValueError("Failed to get LLM response after retries")
 
-            # Ensure the shape is at least predictable
-            if "renames" not in data or not isinstance(data["renames"], list):
-                return {"renames": []}
 
-            return data
-        
-        except RateLimitError as e:
-            # Handle rate limiting with exponential backoff
-            if attempt < max_retries - 1:
-                delay = base_delay * (2 ** attempt)  # Exponential backoff: 1s, 2s, 4s
-                time.sleep(delay)
-                continue
-            else:
-                raise ValueError(f"Rate limit exceeded after {max_retries} attempts: {e}")
-        
+async def create_completion_async(params: Dict[str, Any]) -> Any:
+    """Async version of create_completion, on the running event loop's client pool."""
+    if not api_keys():
+        raise ValueError("OPENAI_API_KEY environment variable is not set")
+
+    pool = get_async_client_pool()
+    for attempt in range(MAX_RETRIES):
+        index, wait = pool.acquire()
+        if wait:
+            await asyncio.sleep(wait)  # Every key is cooling down
+        try:
+            return await pool.clients[index].chat.completions.create(**params)
         except APIError as e:
-            # Handle other API errors (may be transient)
-            if attempt < max_retries - 1 and e.status_code and e.status_code >= 500:
-                # Retry on server errors (5xx)
-                delay = base_delay * (2 ** attempt)
-                time.sleep(delay)
+            await asyncio.sleep(pool.backoff(index, e, attempt))
+
+    raise ValueError("Failed to get LLM response after retries")
+
+
+def request_completion(messages: List[Dict[str, str]]) -> Optional[str]:
+    """
+    Send a chat completion request, retrying rate limits and transient errors.
+    
+    Returns:
+        The model's reply (expected to be a JSON string)
+    
+    Raises:
+        ValueError: If the API key is missing or the request keeps failing
+    """
+    return create_completion(completion_params(messages)).choices[0].message.content
+
+
+def iter_rename_objects(chunks: Iterable[str]) -> Iterator[Dict]:
+    """
+    Incrementally parse a streamed {"renames": [...]} reply.
+    
+    Tracks strings and bracket depth across chunks, and yields each object in
+    the "renames" array as soon as its closing brace arrives.
+    """
+    text = ""
+    pos = None  # Next character to scan once the array has started
+    depth = 0
+    in_string = False
+    escaped = False
+    obj_start = None
+    for chunk in chunks:
+        text += chunk
+        if pos is None:
+            match = RENAMES_ARRAY_RE.search(text)
+            if not match:
                 continue
+            pos = match.end()
+        while pos < len(text):
+            c = text[pos]
+            if in_string:
+                if escaped:
+                    escaped = False
+                elif c == "\\":
+                    escaped = True
+                elif c == '"':
+                    in_string = False
+            elif c == '"':
+                in_string = True
+            elif c in "{[":
+                if depth == 0 and c == "{":
+                    obj_start = pos
+                depth += 1
+            elif c in "}]":
+                if depth == 0:
+                    return  # End of the renames array
+                depth -= 1
+                if depth == 0 and obj_start is not None:
+                    item = parse_json(text[obj_start:pos + 1])
+                    obj_start = None
+                    if isinstance(item, dict):
+                        yield item
+            pos += 1
+
+
+def stream_renames(
+    directory: str,
+    instruction: str,
+    files: List,
+    total_files: Optional[int] = None,
+    use_cache: bool = True
+) -> Iterator[Dict]:
+    """
+    Like get_rename_plan_from_llm, but yields each {"old", "new"} rename as
+    soon as the model has written it, instead of waiting for the whole reply.
+    
+    If the reply cannot be parsed incrementally, it is parsed once complete
+    instead. Complete replies are cached just like get_rename_plan_from_llm.
+    """
+    plan, user_prompt, cache_key, near_key = prepare_request(directory, instruction, files, total_files, use_cache)
+    if plan is not None:
+        yield from plan["renames"]
+        return
+
+    # Only opening the stream is retried; once renames are flowing an error ends the plan
+    stream = create_completion({**completion_params(build_messages(user_prompt)), "stream": True})
+
+    parts: List[str] = []
+
+    def chunks() -> Iterator[str]:
+        for event in stream:
+            delta = event.choices[0].delta.content if event.choices else None
+            if delta:
+                parts.append(delta)
+                yield delta
+
+    streamed = 0
+    try:
+        for item in iter_rename_objects(chunks()):
+            streamed += 1
+            yield item
+    except json.JSONDecodeError:
+        pass  # Fall back to parsing the complete reply below
+    for _ in chunks():
+        pass  # Drain the rest of the reply
+
+    data = parse_plan_content("".join(parts))
+    if data is None:
+        if streamed:
+            # Renames were already handed out, so an empty plan is no longer an option
+            raise ValueError(f"LLM reply was malformed after {streamed} renames")
+        return
+    # iter_rename_objects only yields objects, so with any other element in the
+    # array the first `streamed` entries would not be the ones already yielded
+    for item in data["renames"]:
+        if not isinstance(item, dict):
+            raise ValueError(f"Each rename entry must be an object. Got: {type(item)}")
+    yield from data["renames"][streamed:]
+    store_cached_response(cache_key, near_key, data)
+
+
+def get_rename_plans_batched(
+    requests: List[Dict[str, Any]],
+    jobs_per_call: int = MAX_JOBS_PER_CALL,
+    use_cache: bool = True
+) -> List[Dict]:
+    """
+    Get rename plans for several independent requests, packing up to
+    jobs_per_call of them into each LLM call so the system prompt is sent
+    once per call rather than once per request.
+    
+    Requests with a cached response are answered from the cache, and fresh
+    answers are cached per request just like get_rename_plan_from_llm.
+    
+    Args:
+        requests: One dict per request with directory, instruction, files and optionally total_files
+        jobs_per_call: Most requests packed into one call
+        use_cache: Return cached responses where there are any
+    
+    Returns:
+        Plans in the same order as requests; a job the model did not answer
+        properly gets an empty plan
+    """
+    plans: List[Optional[Dict]] = [None] * len(requests)
+    pending = []
+    for index, request in enumerate(requests):
+        directory, instruction, files = request["directory"], request["instruction"], request["files"]
+        total_files = request.get("total_files")
+        plans[index], _, cache_key, near_key = prepare_request(directory, instruction, files, total_files, use_cache)
+        if plans[index] is None:
+            payload = build_prompt_payload(directory, instruction, files, total_files)
+            pending.append((index, cache_key, near_key, payload))
+
+    for start in range(0, len(pending), jobs_per_call):
+        chunk = pending[start:start + jobs_per_call]
+        jobs = [{"id": f"j{index}", **payload} for index, _, _, payload in chunk]
+        content = request_completion(build_messages(to_prompt_json({"jobs": jobs}), batched=True))
+        results = parse_batch_content(content)
+        for index, cache_key, near_key, _ in chunk:
+            data = results.get(f"j{index}")
+            if data is None:
+                plans[index] = {"renames": []}
             else:
-                raise ValueError(f"LLM API error: {e}")
+                store_cached_response(cache_key, near_key, data)
+                plans[index] = data
+    return plans
+
+
+def parse_batch_content(content: Optional[str]) -> Dict[str, Dict]:
+    """
+    Parse the model's reply to a batched request.
     
-    # Should not reach here, but just in case
-    raise ValueError("Failed to get LLM response after retries")
+    Returns:
+        Plan dictionary for each job id that has a well-formed 'renames' list
+    """
+    try:
+        data = parse_json(content)
+    except (json.JSONDecodeError, TypeError):
+        return {}
+    results = data.get("results") if isinstance(data, dict) else None
+    if not isinstance(results, list):
+        return {}
+    return {
+        result["id"]: {"renames": result["renames"]}
+        for result in results
+        if isinstance(result, dict) and isinstance(result.get("id"), str) and isinstance(result.get("renames"), list)
+    }
+
+
+def submit_batch(requests: List[Dict[str, Any]]) -> str:
+    """
+    Submit rename requests to the OpenAI Batch API, which answers within 24
+    hours at a lower price than synchronous calls.
+    
+    Args:
+        requests: One dict per request with directory, instruction, files and optionally total_files
+    
+    Returns:
+        Batch id to pass to poll_batch
+    """
+    if not api_keys():
+        raise ValueError("OPENAI_API_KEY environment variable is not set")
+
+    lines = []
+    for index, request in enumerate(requests):
+        user_prompt = build_user_prompt(
+            request["directory"], request["instruction"], request["files"], request.get("total_files")
+        )
+        lines.append(to_prompt_json({
+            "custom_id": f"request-{index}",
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": batch_request_body(build_messages(user_prompt)),
+        }))
+
+    client = get_client()
+    input_file = client.files.create(
+        file=("rename_requests.jsonl", "\n".join(lines).encode("utf-8")),
+        purpose="batch",
+    )
+    batch = client.batches.create(
+        input_file_id=input_file.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h",
+    )
+    logger.info("Submitted batch %s with %d requests", batch.id, len(requests))
+    return batch.id
+
+
+def batch_result_error(result: Dict[str, Any]) -> Optional[str]:
+    """Return why a Batch API request failed, or None if it got an answer."""
+    error = result.get("error")
+    if isinstance(error, dict):
+        return error.get("message") or str(error)
+    if error:
+        return str(error)
+    response = result.get("response") or {}
+    status_code = response.get("status_code", 200)
+    if status_code != 200:
+        body_error = (response.get("body") or {}).get("error") or {}
+        return body_error.get("message") or f"HTTP {status_code}"
+    return None
+
+
+def poll_batch(
+    batch_id: str,
+    requests: List[Dict[str, Any]],
+    poll_interval: float = BATCH_POLL_INTERVAL
+) -> List[Union[Dict, ValueError]]:
+    """
+    Wait for a Batch API job to finish and return its rename plans.
+    
+    Answers are cached per request just like get_rename_plan_from_llm.
+    
+    Args:
+        batch_id: Id returned by submit_batch
+        requests: The requests passed to submit_batch, in the same order
+        poll_interval: Seconds between status checks
+    
+    Returns:
+        Plans in the order the requests were submitted. A request the API
+        failed (or left unanswered) has a ValueError in its place; one whose
+        answer is not a well-formed plan gets an empty plan.
+    
+    Raises:
+        ValueError: If the batch failed, expired or was cancelled
+    """
+    client = get_client()
+    while True:
+        batch = client.batches.retrieve(batch_id)
+        if batch.status == "completed":
+            break
+        if batch.status in BATCH_FAILED_STATES:
+            raise ValueError(f"Batch {batch_id} {batch.status}")
+        logger.info("Batch %s is %s; checking again in %ss", batch_id, batch.status, poll_interval)
+        time.sleep(poll_interval)
+
+    plans: List[Union[Dict, ValueError]] = [
+        ValueError(f"Batch {batch_id} returned no answer for this request") for _ in requests
+    ]
+    # Answers are in the output file, requests the API failed in the error file
+    for file_id in (batch.output_file_id, batch.error_file_id):
+        if file_id is None:
+            continue
+        for line in client.files.content(file_id).text.splitlines():
+            if not line.strip():
+                continue
+            result = parse_json(line)
+            index = int(result["custom_id"].rsplit("-", 1)[1])
+            if not 0 <= index < len(plans):
+                continue
+            error = batch_result_error(result)
+            if error is not None:
+                plans[index] = ValueError(f"LLM API error: {error}")
+                continue
+            body = (result.get("response") or {}).get("body") or {}
+            choices = body.get("choices") or [{}]
+            data = parse_plan_content(choices[0].get("message", {}).get("content"))
+            if data is None:
+                plans[index] = {"renames": []}
+                continue
+            request = requests[index]
+            _, _, cache_key, near_key = prepare_request(
+                request["directory"], request["instruction"], request["files"], request.get("total_files"),
+                use_cache=False,
+            )
+            store_cached_response(cache_key, near_key, data)
+            plans[index] = data
+    return plans
+
+
+def cached_rename_plan(
+    directory: str,
+    instruction: str,
+    files: List,
+    total_files: Optional[int] = None
+) -> Optional[Dict]:
+    """Return the plan a request would get without calling the LLM (a cached response), if any."""
+    plan, _, _, _ = prepare_request(directory, instruction, files, total_files)
+    return plan
+
+
+async def get_rename_plan_async(
+    directory: str,
+    instruction: str,
+    files: List,
+    total_files: Optional[int] = None,
+    use_cache: bool = True
+) -> Dict:
+    """
+    Async version of get_rename_plan_from_llm, using the shared AsyncOpenAI client.
+    
+    Takes the same arguments and returns the same plan dictionary; many of
+    these can run concurrently (see get_rename_plans_concurrent).
+    """
+    plan, user_prompt, cache_key, near_key = prepare_request(directory, instruction, files, total_files, use_cache)
+    if plan is not None:
+        return plan
+
+    response = await create_completion_async(completion_params(build_messages(user_prompt)))
+    data = parse_plan_content(response.choices[0].message.content)
+    if data is None:
+        return {"renames": []}
+    store_cached_response(cache_key, near_key, data)
+    return data
+
+
+async def get_rename_plans_concurrent(
+    requests: List[Dict[str, Any]],
+    max_concurrency: int = MAX_CONCURRENT_REQUESTS
+) -> List[Union[Dict, ValueError]]:
+    """
+    Get rename plans for several requests concurrently.
+    
+    Args:
+        requests: Keyword arguments for get_rename_plan_async, one dict per
+            request (directory, instruction, files and optionally total_files, use_cache)
+        max_concurrency: Most requests in flight at once
+    
+    Returns:
+        Plans in the same order as requests; a request that failed has a
+        ValueError in its place instead of a plan
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def run(request: Dict[str, Any]) -> Dict:
+        async with semaphore:
+            return await get_rename_plan_async(**request)
 
+    results = await asyncio.gather(*(run(request) for request in requests), return_exceptions=True)
+    return [
+        result if isinstance(result, (dict, ValueError)) else ValueError(f"Error calling LLM: {result}")
+        for result in results
+    ]
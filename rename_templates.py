@@ -0,0 +1,257 @@
+"""Rename templates - learn simple numbered rename patterns and apply them without the LLM."""
+import os
+import re
+from typing import List, Dict, Optional, Any, Set
+
+# Runs of digits in a file name, compared as numbers when ordering by name
+DIGITS_RE = re.compile(r'(\d+)')
+
+# A numbered target name: prefix, optional separator, sequence number, optional extension
+NUMBERED_NAME_RE = re.compile(r'(?P<prefix>.*?)(?P<sep>[_\-]?)(?P<num>\d+)(?P<ext>\.[^.]*)?')
+
+# Orderings a template can use, mapped to the file info key they sort on
+ORDER_KEYS = {
+    'name': 'name',
+    'creation': 'creation_time',
+    'modification': 'modification_time',
+    'access': 'access_time',
+    'size': 'size',
+}
+
+# Ordering phrases accepted after "ordered by", mapped to ORDER_KEYS orderings.
+# Bare "date" is left to the LLM since it does not say which timestamp.
+TRIVIAL_ORDERS = {
+    'name': 'name', 'filename': 'name', 'file name': 'name',
+    'creation': 'creation', 'creation date': 'creation', 'creation time': 'creation',
+    'date created': 'creation', 'created': 'creation',
+    'modification': 'modification', 'modification date': 'modification', 'modification time': 'modification',
+    'date modified': 'modification', 'modified': 'modification', 'last modified': 'modification',
+    'access': 'access', 'access date': 'access', 'access time': 'access',
+    'date accessed': 'access', 'accessed': 'access', 'last accessed': 'access',
+    'size': 'size', 'file size': 'size',
+}
+
+# Direction phrases, mapped to (orderings they make sense for, reverse)
+TRIVIAL_DIRECTIONS = {
+    'ascending': (tuple(ORDER_KEYS), False),
+    'descending': (tuple(ORDER_KEYS), True),
+    'reversed': (tuple(ORDER_KEYS), True),
+    'oldest first': (('creation', 'modification', 'access'), False),
+    'newest first': (('creation', 'modification', 'access'), True),
+    'smallest first': (('size',), False),
+    'largest first': (('size',), True),
+    'biggest first': (('size',), True),
+}
+
+# Instructions simple enough to plan without the LLM, e.g.
+# "rename all jpg files to vacation_###.jpg ordered by creation date, oldest first".
+# The '#' run is the sequence number; more than one '#' zero-pads to that width.
+TRIVIAL_INSTRUCTION_RE = re.compile(r"""
+    (?:rename|renumber|number)\s+
+    (?:(?:all\s+)?(?:the\s+)?(?:\.?(?P<type>[a-z0-9]+)\s+)?files\s+)?
+    (?:to|as|into)\s+
+    (?P<prefix>[^\s#/\\]*?)(?P<hashes>\#+)(?P<ext>\.[a-z0-9]+)?
+    (?:,?\s+(?:ordered|sorted|numbered)\s+by\s+(?P<order>[a-z ]+?))?
+    (?:,?\s+\(?(?P<direction>""" + "|".join(re.escape(d) for d in TRIVIAL_DIRECTIONS) + r""")\)?)?
+    \.?
+""", re.IGNORECASE | re.VERBOSE)
+
+
+def normalize_instruction(instruction: str) -> str:
+    """
+    Normalize whitespace so trivially different spacings share a template.
+    
+    Case is kept: the instruction may spell the prefix ("Holiday" vs "HOLIDAY").
+    """
+    return " ".join(instruction.split())
+
+
+def natural_key(name: str) -> List[Any]:
+    """Sort key that compares runs of digits as numbers, so IMG_2 comes before IMG_10."""
+    # re.split with a group alternates text and digits, so parts line up by type
+    return [int(part) if i % 2 else part for i, part in enumerate(DIGITS_RE.split(name))]
+
+
+def visible_files(files: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Drop hidden files (.DS_Store, ...), which local plans never rename."""
+    return [f for f in files if not f["name"].startswith(".")]
+
+
+def sort_files(files: List[Dict[str, Any]], order: str, reverse: bool) -> Optional[List[Dict[str, Any]]]:
+    """
+    Sort files by a template ordering, breaking ties by name.
+    
+    Names compare numbers by value (see natural_key), as the LLM does.
+
+    Returns:
+        Sorted list of files, or None if the files lack the metadata for that ordering
+    """
+    key = ORDER_KEYS[order]
+    if any(key not in f for f in files):
+        return None
+    if order == 'name':
+        return sorted(files, key=lambda f: (natural_key(f["name"]), f["name"]), reverse=reverse)
+    return sorted(files, key=lambda f: (f[key], natural_key(f["name"]), f["name"]), reverse=reverse)
+
+
+def common_prefix(names: List[str]) -> str:
+    """Return the longest prefix shared by all names, minus any trailing digits of a running number."""
+    return os.path.commonprefix(names).rstrip("0123456789") if names else ""
+
+
+def derive_template(
+    files: List[Dict[str, Any]],
+    renames: List[Dict],
+    preferred_orders: Set[str]
+) -> Optional[Dict[str, Any]]:
+    """
+    Derive a reusable template from a rename plan, if the plan is a simple numbering.
+
+    The plan must rename every listed file except hidden ones (see
+    visible_files) to <prefix><sep><number><ext> with
+    consecutive numbers, in an order reproduced by exactly one ORDER_KEYS
+    ordering. Candidate orderings are narrowed to preferred_orders (the
+    metadata the instruction asked about, or 'name' when it asked about none).
+
+    Args:
+        files: File info dictionaries the plan was made from (the complete listing)
+        renames: Validated rename plan
+        preferred_orders: ORDER_KEYS orderings the instruction refers to
+
+    Returns:
+        Template dictionary, or None if the plan is not a simple numbering
+    """
+    files = visible_files(files)
+    names = [f["name"] for f in files]
+    if len(renames) < 2 or len(renames) != len(files):
+        return None
+    if {item["old"] for item in renames} != set(names):
+        return None
+
+    matches = {}
+    for item in renames:
+        match = NUMBERED_NAME_RE.fullmatch(item["new"])
+        if not match:
+            return None
+        matches[item["old"]] = match
+
+    if len({(m["prefix"], m["sep"]) for m in matches.values()}) != 1:
+        return None
+    first = next(iter(matches.values()))
+
+    # Extension rule: keep each source extension, or use one fixed extension
+    new_exts = {old: m["ext"] or "" for old, m in matches.items()}
+    if all(ext == os.path.splitext(old)[1] for old, ext in new_exts.items()):
+        ext = None
+    elif len(set(new_exts.values())) == 1:
+        ext = first["ext"] or ""
+    else:
+        return None
+
+    # Numbers must be consecutive from 0 or 1, either all zero-padded to one width or unpadded
+    digits = {old: m["num"] for old, m in matches.items()}
+    numbers = sorted(int(d) for d in digits.values())
+    start = numbers[0]
+    if start not in (0, 1) or numbers != list(range(start, start + len(numbers))):
+        return None
+    if all(d == str(int(d)) for d in digits.values()):
+        width = 0
+    elif len({len(d) for d in digits.values()}) == 1:
+        width = len(first["num"])
+    else:
+        return None
+
+    # Find the ordering that reproduces the numbering
+    sequence = sorted(digits, key=lambda old: int(digits[old]))
+    candidates = []
+    for order in ORDER_KEYS:
+        if order not in (preferred_orders or {'name'}):
+            continue
+        for reverse in (False, True):
+            ordered = sort_files(files, order, reverse)
+            if ordered is not None and [f["name"] for f in ordered] == sequence:
+                candidates.append((order, reverse))
+    if len(candidates) != 1:
+        return None
+    order, reverse = candidates[0]
+
+    return {
+        "prefix": first["prefix"],
+        "sep": first["sep"],
+        "start": start,
+        "width": width,
+        "ext": ext,
+        "order": order,
+        "reverse": reverse,
+        # What the source files looked like, so the template is only reused on similar listings
+        "source_prefix": common_prefix(names),
+        "source_exts": sorted({os.path.splitext(name)[1].lower() for name in names}),
+    }
+
+
+def parse_trivial_instruction(instruction: str) -> Optional[Dict[str, Any]]:
+    """
+    Parse an instruction that fully spells out a numbering, such as
+    "rename all jpg files to photo_###.jpg ordered by date modified".
+    
+    Returns:
+        Template dictionary usable with apply_template, or None if the
+        instruction needs the LLM to interpret it
+    """
+    match = TRIVIAL_INSTRUCTION_RE.fullmatch(" ".join(instruction.split()))
+    if not match:
+        return None
+
+    order = TRIVIAL_ORDERS.get((match["order"] or "name").lower())
+    if order is None:
+        return None
+    reverse = False
+    if match["direction"]:
+        direction = TRIVIAL_DIRECTIONS.get(match["direction"].lower())
+        if direction is None or order not in direction[0]:
+            return None
+        reverse = direction[1]
+
+    hashes = match["hashes"]
+    file_type = match["type"]
+    return {
+        "prefix": match["prefix"],
+        "sep": "",
+        "start": 1,
+        "width": len(hashes) if len(hashes) > 1 else 0,
+        "ext": match["ext"],
+        "order": order,
+        "reverse": reverse,
+        # A named file type must be what was listed, so other files are never renumbered
+        "source_prefix": "",
+        "source_exts": [f".{file_type.lower()}"] if file_type else None,
+    }
+
+
+def apply_template(template: Dict[str, Any], files: List[Dict[str, Any]]) -> Optional[List[Dict]]:
+    """
+    Generate a rename plan for files from a template. Hidden files are left alone.
+
+    Returns:
+        List of {'old', 'new'} renames, or None if the files do not resemble the
+        listing the template was learned from or lack the metadata to order them
+    """
+    files = visible_files(files)
+    if not files:
+        return None
+    if not all(f["name"].startswith(template["source_prefix"]) for f in files):
+        return None
+    source_exts = template["source_exts"]
+    if source_exts is not None and not {os.path.splitext(f["name"])[1].lower() for f in files} <= set(source_exts):
+        return None
+
+    ordered = sort_files(files, template["order"], template["reverse"])
+    if ordered is None:
+        return None
+
+    renames = []
+    for number, f in enumerate(ordered, start=template["start"]):
+        ext = os.path.splitext(f["name"])[1] if template["ext"] is None else template["ext"]
+        new = f"{template['prefix']}{template['sep']}{str(number).zfill(template['width'])}{ext}"
+        renames.append({"old": f["name"], "new": new})
+    return renames